@@ -2,50 +2,223 @@
 Convert MIDI file to WAV audio using pretty_midi
 """
 
+import contextlib
+import os
+import wave
+from concurrent.futures import ThreadPoolExecutor
+
 import pretty_midi
-import scipy.io.wavfile
 import numpy as np
 
+try:
+    import fluidsynth
+except (ImportError, OSError):
+    # pyfluidsynth raises ImportError when libfluidsynth cannot be found and
+    # ctypes raises OSError when it is found but fails to load
+    fluidsynth = None
+HAS_FLUIDSYNTH = fluidsynth is not None
+
 # ============= CONFIGURATION =============
 MIDI_FILE = "spikes_sonified.mid"
 OUTPUT_WAV = "spikes_sonified.wav"
 SAMPLE_RATE = 44100  # CD quality
+SOUNDFONT = "./CindyBells.sf2"
+SYNTH_CPU_CORES = max((os.cpu_count() or 1) // 2, 1)  # FluidSynth rendering threads
+WRITE_BUFFER_SIZE = 1 << 20  # Bytes buffered per write to the output file
+WRITE_CHUNK_SIZE = 1 << 20  # Samples converted to 16-bit PCM per block
 # ==========================================
 
 
-def midi_to_wav(midi_file, output_wav, sample_rate=44100):
+def write_wav(output_wav, audio_data, sample_rate, scale=32767.0):
     """
-    Convert MIDI to WAV audio file.
+    Stream float audio to a mono 16-bit WAV file in fixed-size blocks.
+
+    Each block is scaled, rounded and clipped in a reusable scratch buffer
+    before being written, so memory use does not grow with track length and
+    `audio_data` itself is left untouched.
+
+    Parameters:
+    -----------
+    output_wav : str or file-like
+        Path to output WAV file, or a writable binary file object (e.g.
+        io.BytesIO) to keep the audio in memory
+    audio_data : np.ndarray
+        Float audio samples
+    sample_rate : int
+        Audio sample rate
+    scale : float
+        Factor mapping audio_data onto the 16-bit range
+    """
+    block = np.empty(min(WRITE_CHUNK_SIZE, len(audio_data)), dtype=np.float64)
+    block_int16 = np.empty(block.shape, dtype=np.int16)
+
+    if isinstance(output_wav, (str, os.PathLike)):
+        output = open(output_wav, "wb", buffering=WRITE_BUFFER_SIZE)
+    else:
+        # Caller owns the file object, so leave it open
+        output = contextlib.nullcontext(output_wav)
+
+    with output as f:
+        with wave.open(f, "wb") as wf:
+            wf.setnchannels(1)
+            wf.setsampwidth(2)
+            wf.setframerate(sample_rate)
+            # Writing the final length up front means the header never has
+            # to be patched, so the output need not be seekable
+            wf.setnframes(len(audio_data))
+
+            for i in range(0, len(audio_data), WRITE_CHUNK_SIZE):
+                chunk = audio_data[i : i + WRITE_CHUNK_SIZE]
+                buf = block[: len(chunk)]
+                out = block_int16[: len(chunk)]
+
+                # Round to nearest and clip so that floating point error at
+                # the peak cannot wrap around in the 16-bit conversion
+                np.multiply(chunk, scale, out=buf)
+                np.rint(buf, out=buf)
+                np.clip(buf, -32768, 32767, out=buf)
+                out[:] = buf
+                wf.writeframesraw(out)
+
+
+def synthesize_midi(midi_file, sample_rate=44100):
+    """
+    Load a MIDI file and synthesize it to an unnormalized float waveform.
 
     Parameters:
     -----------
     midi_file : str
         Path to input MIDI file
-    output_wav : str
-        Path to output WAV file
     sample_rate : int
-        Audio sample rate (44100 = CD quality)
+        Audio sample rate
+
+    Returns:
+    --------
+    np.ndarray : synthesized audio samples
     """
-    print(f"Loading MIDI file: {midi_file}")
+    # Checked per call: SOUNDFONT is relative to the current directory
+    if not os.path.exists(SOUNDFONT):
+        raise FileNotFoundError(f"No soundfont file found at {SOUNDFONT}")
+
+    if not HAS_FLUIDSYNTH:
+        raise ImportError(
+            "Synthesis requires pyfluidsynth and the FluidSynth library"
+        )
+
     pm = pretty_midi.PrettyMIDI(midi_file)
 
-    print(f"Synthesizing audio (this may take a moment)...")
-    audio_data = pm.fluidsynth(fs=sample_rate, synthesizer="./CindyBells.sf2")
+    # Build the synth ourselves so FluidSynth can render voices on several
+    # cores; settings must be given at construction to take effect
+    synth = fluidsynth.Synth(
+        samplerate=sample_rate, **{"synth.cpu-cores": SYNTH_CPU_CORES}
+    )
+    try:
+        sfid = synth.sfload(SOUNDFONT)
+        # Skip pretty_midi's own normalization (which allocates an abs() copy
+        # of the whole buffer); the peak scaling in save_wav normalizes it anyway
+        return pm.fluidsynth(
+            fs=sample_rate, synthesizer=synth, sfid=sfid, normalize=False
+        )
+    finally:
+        synth.delete()
 
-    # Normalize audio to prevent clipping
-    audio_data = audio_data / np.max(np.abs(audio_data))
 
-    # Convert to 16-bit PCM
-    audio_data = (audio_data * 32767).astype(np.int16)
+def save_wav(audio_data, output_wav, sample_rate=44100):
+    """
+    Normalize synthesized audio and save it as a 16-bit WAV file.
 
-    print(f"Saving to {output_wav}...")
-    scipy.io.wavfile.write(output_wav, sample_rate, audio_data)
+    Parameters:
+    -----------
+    audio_data : np.ndarray
+        Synthesized audio samples
+    output_wav : str or file-like
+        Path to output WAV file, or a writable binary file object
+    sample_rate : int
+        Audio sample rate
+    """
+    # Normalize audio to prevent clipping; the scaling to 16-bit PCM happens
+    # block by block as the file is written
+    # A MIDI with no notes renders to an empty array, which has no peak
+    if len(audio_data):
+        peak = max(float(audio_data.max()), -float(audio_data.min()))
+    else:
+        peak = 0.0
+    # A silent or empty render has nothing to normalize; write it as silence
+    scale = 32767.0 / peak if peak > 0 else 0.0
+
+    is_path = isinstance(output_wav, (str, os.PathLike))
+    if is_path:
+        print(f"Saving to {output_wav}...")
+    write_wav(output_wav, audio_data, sample_rate, scale=scale)
 
     duration = len(audio_data) / sample_rate
     print(f"\n✓ Audio file created!")
     print(f"  Duration: {duration:.2f} seconds")
     print(f"  Sample rate: {sample_rate} Hz")
-    print(f"  File: {output_wav}")
+    if is_path:
+        print(f"  File: {output_wav}")
+
+
+def midis_to_wavs(midi_files, output_wavs, sample_rate=44100):
+    """
+    Convert several MIDI files to WAV, pipelining synthesis with saving.
+
+    Synthesis runs on a background thread, so file N+1 is synthesized while
+    file N is normalized and written to disk.
+
+    Parameters:
+    -----------
+    midi_files : list of str
+        Paths to input MIDI files
+    output_wavs : list of str or file-like
+        Output WAV paths or writable binary file objects, one per MIDI file
+    sample_rate : int
+        Audio sample rate (44100 = CD quality)
+    """
+    jobs = list(zip(midi_files, output_wavs, strict=True))
+    if len(jobs) < 2:
+        # Nothing to overlap, so keep synthesis on the main thread where
+        # Ctrl-C can interrupt it
+        for midi_file, output_wav in jobs:
+            midi_to_wav(midi_file, output_wav, sample_rate)
+        return
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+
+        def submit(midi_file):
+            print(f"Synthesizing {midi_file} (this may take a moment)...")
+            return executor.submit(synthesize_midi, midi_file, sample_rate)
+
+        future = submit(jobs[0][0])
+        for i, (midi_file, output_wav) in enumerate(jobs):
+            audio_data = future.result()
+            if i + 1 < len(jobs):
+                future = submit(jobs[i + 1][0])
+            save_wav(audio_data, output_wav, sample_rate)
+            # Release the float buffer before the next one is collected
+            del audio_data
+
+    print(f"\nYou can now play this in any audio player!")
+
+
+def midi_to_wav(midi_file, output_wav, sample_rate=44100):
+    """
+    Convert MIDI to WAV audio file.
+
+    Parameters:
+    -----------
+    midi_file : str
+        Path to input MIDI file
+    output_wav : str or file-like
+        Path to output WAV file, or a writable binary file object (e.g.
+        io.BytesIO) to skip the disk entirely
+    sample_rate : int
+        Audio sample rate (44100 = CD quality)
+    """
+    print(f"Synthesizing {midi_file} (this may take a moment)...")
+    audio_data = synthesize_midi(midi_file, sample_rate)
+    save_wav(audio_data, output_wav, sample_rate)
+
     print(f"\nYou can now play this in any audio player!")
 
 
@@ -57,45 +57,59 @@ OCTAVE_SPREAD = 12  # Semitones per octave
 # Which units to sonify
 UNITS_TO_SONIFY = None  # None = all units, or list like [0, 1, 2, 5]
 MAX_UNITS = 21 # Maximum number of units
+# True = all units share one instrument (faster synthesis). Units with the
+# same pitch then share a MIDI channel, so overlapping notes cut each other off
+SINGLE_INSTRUMENT = False
 # ==========================================
 
+# Note names for every MIDI pitch, e.g. NOTE_NAMES[60] == "C4"
+NOTE_NAMES = [pretty_midi.note_number_to_name(i) for i in range(128)]
 
-def parse_spike_times(spike_times_str):
-    """Convert string representation back to numpy array."""
-    cleaned = spike_times_str.strip("[]")
-    values = cleaned.split()
-    return np.array([float(v) for v in values])
+
+def parse_spike_times(spike_times):
+    """Convert a string representation column back to a List(Float64) column."""
+    # Split on any whitespace run, since numpy's array repr pads and wraps lines
+    return (
+        spike_times.str.strip_chars("[]")
+        .str.extract_all(r"\S+")
+        .list.eval(pl.element().cast(pl.Float64))
+    )
 
 
-def get_pitch_for_unit(unit_idx, unit_id, spike_times, mode="custom"):
+def get_pitches_for_units(unit_ids, spike_counts, spike_spans, mode="custom"):
     """
-    Determine pitch for a unit based on selected mode.
+    Determine pitches for all units at once based on selected mode.
 
     Parameters:
     -----------
-    unit_idx : int
-        Index in the dataset (0, 1, 2, ...)
-    unit_id : int
-        Actual unit ID from kilosort
-    spike_times : array
-        Spike times for this unit
+    unit_ids : array
+        Actual unit IDs from kilosort, in dataset order
+    spike_counts : array
+        Number of spikes for each unit
+    spike_spans : array
+        Time between the first and last spike of each unit
     mode : str
         Pitch assignment mode
 
     Returns:
     --------
-    int : MIDI pitch (0-127)
+    np.ndarray : MIDI pitch (0-127) for each unit
     """
+    unit_ids = np.asarray(unit_ids)
+    unit_idx = np.arange(len(unit_ids))
+    min_pitch, max_pitch = PITCH_RANGE
 
     if mode == "custom":
         # Use custom mapping if defined, otherwise default
-        return CUSTOM_PITCHES.get(unit_idx, DEFAULT_PITCH)
+        return np.array(
+            [CUSTOM_PITCHES.get(i, DEFAULT_PITCH) for i in range(len(unit_ids))],
+            dtype=np.int64,
+        )
 
     elif mode == "spread":
         # Spread evenly across pitch range
-        min_pitch, max_pitch = PITCH_RANGE
         normalized = unit_idx / max(MAX_UNITS - 1, 1)
-        return int(min_pitch + normalized * (max_pitch - min_pitch))
+        return (min_pitch + normalized * (max_pitch - min_pitch)).astype(np.int64)
 
     elif mode == "octaves":
         # Spread units across octaves (C, C, C, etc.)
@@ -106,23 +120,88 @@ def get_pitch_for_unit(unit_idx, unit_id, spike_times, mode="custom"):
 
     elif mode == "firing_rate":
         # Map firing rate to pitch (higher rate = higher pitch)
-        if len(spike_times) > 0:
-            duration = spike_times[-1] - spike_times[0]
-            firing_rate = len(spike_times) / duration if duration > 0 else 0
-            # Map 0-50 Hz to pitch range
-            min_pitch, max_pitch = PITCH_RANGE
-            normalized = min(firing_rate / 50.0, 1.0)
-            return int(min_pitch + normalized * (max_pitch - min_pitch))
-        return DEFAULT_PITCH
+        spike_counts = np.asarray(spike_counts, dtype=np.float64)
+        spike_spans = np.asarray(spike_spans, dtype=np.float64)
+        firing_rate = np.divide(
+            spike_counts,
+            spike_spans,
+            out=np.zeros_like(spike_counts),
+            where=spike_spans > 0,
+        )
+        # Map 0-50 Hz to pitch range
+        normalized = np.minimum(firing_rate / 50.0, 1.0)
+        pitches = (min_pitch + normalized * (max_pitch - min_pitch)).astype(np.int64)
+        return np.where(spike_counts > 0, pitches, DEFAULT_PITCH)
 
     elif mode == "random":
-        # Random but consistent (based on unit_id)
-        np.random.seed(unit_id)
-        min_pitch, max_pitch = PITCH_RANGE
-        return np.random.randint(min_pitch, max_pitch + 1)
+        # Random but consistent (based on unit_id), without touching the
+        # global numpy RNG state
+        return np.array(
+            [
+                np.random.default_rng(unit_id).integers(min_pitch, max_pitch + 1)
+                for unit_id in unit_ids.tolist()
+            ],
+            dtype=np.int64,
+        )
 
     else:
-        return DEFAULT_PITCH
+        return np.full(len(unit_ids), DEFAULT_PITCH, dtype=np.int64)
+
+
+def _make_notes(starts, ends, pitch, velocity):
+    """
+    Build pretty_midi Notes from parallel start/end time arrays.
+
+    `pitch` is either one MIDI pitch for every note or an array of per-note
+    pitches.
+    """
+    Note = pretty_midi.Note
+    pitches = np.broadcast_to(pitch, starts.shape).tolist()
+    return [
+        Note(velocity=velocity, pitch=pitch, start=start, end=end)
+        for start, end, pitch in zip(starts.tolist(), ends.tolist(), pitches)
+    ]
+
+
+def _unit_note_times(spike_times, time_scale, note_duration):
+    """
+    Convert a single unit's spike train into note start and end times.
+
+    Returns:
+    --------
+    tuple : (note_starts, note_ends)
+    """
+
+    # Keep notes in start order: pm.write and fluidsynth sort every event with
+    # a Python comparator, which is linear on already-sorted input
+    if np.any(spike_times[1:] < spike_times[:-1]):
+        spike_times = np.sort(spike_times)
+
+    # Scale time and compute note end times in one vectorized pass
+    note_starts = spike_times * time_scale
+    note_ends = note_starts + note_duration
+    return note_starts, note_ends
+
+
+def _build_instrument(
+    idx, unit_id, spike_times, time_scale, note_duration, base_velocity, pitch
+):
+    """
+    Build the MIDI instrument for a single unit.
+
+    Returns:
+    --------
+    tuple : (instrument, note_ends)
+    """
+    note_starts, note_ends = _unit_note_times(spike_times, time_scale, note_duration)
+
+    # Create instrument for this unit
+    instrument = pretty_midi.Instrument(program=idx % 128, name=f"Unit_{unit_id}")
+
+    # Add notes for each spike
+    instrument.notes = _make_notes(note_starts, note_ends, pitch, base_velocity)
+
+    return instrument, note_ends
 
 
 def create_midi_from_spikes(
@@ -134,63 +213,146 @@ def create_midi_from_spikes(
     units_to_sonify=None,
     max_units=16,
     pitch_mode="custom",
+    single_instrument=False,
 ):
     """
     Load spike times from Parquet and create a MIDI file with custom pitches.
+
+    The Parquet file is expected to have a `unit_id` column and a
+    `spike_times` column. The preferred type for `spike_times` is
+    `pl.List(pl.Float64)`, which is read without any parsing; legacy files
+    storing each spike train as a stringified "[t0 t1 ...]" array are still
+    supported and are parsed by Polars while the file is loaded.
+
+    With `single_instrument=True` every unit's notes go into one shared
+    instrument (program 0), each note keeping its unit's pitch. This trades
+    per-unit timbre for a smaller MIDI file and cheaper synthesis. Units are
+    no longer separated by channel, so units that map to the same pitch
+    (e.g. every unit past CUSTOM_PITCHES falling back to DEFAULT_PITCH, or
+    all units above 50 Hz in 'firing_rate' mode) collide: where their notes
+    overlap, one unit's note-off cuts the other's note short. "Total notes"
+    still counts every spike.
     """
 
-    # Load the Parquet file
+    # Scan the Parquet file lazily so only the needed columns and rows are
+    # decoded; the projection, row filter and limit are pushed into the reader
     print(f"Loading spike times from {parquet_file}...")
-    df = pl.read_parquet(parquet_file)
-    print(f"Loaded {len(df)} units\n")
+    lf = pl.scan_parquet(parquet_file).select("unit_id", "spike_times")
+    n_units = lf.select(pl.len()).collect().item()
+    print(f"Loaded {n_units} units\n")
 
     # Filter units if specified
     if units_to_sonify is not None:
-        df = df[units_to_sonify]
-        print(f"Filtered to {len(df)} specified units")
+        out_of_range = [i for i in units_to_sonify if not 0 <= i < n_units]
+        if out_of_range:
+            raise IndexError(
+                f"units_to_sonify indices {out_of_range} out of range for {n_units} units"
+            )
+        lf = (
+            lf.with_row_index("row_nr")
+            .filter(pl.col("row_nr").is_in(units_to_sonify))
+            .drop("row_nr")
+        )
+        n_units = lf.select(pl.len()).collect().item()
+        print(f"Filtered to {n_units} specified units")
 
     # Limit to max_units
-    if len(df) > max_units:
+    if n_units > max_units:
         print(f"Limiting to first {max_units} units")
-        df = df[:max_units]
+    lf = lf.head(max_units)
+
+    # Legacy files store spike trains as strings; parse them all in one
+    # Polars expression so everything downstream sees List(Float64)
+    if lf.collect_schema()["spike_times"] == pl.Utf8:
+        lf = lf.with_columns(parse_spike_times(pl.col("spike_times")))
+    df = lf.collect()
+    unit_ids = df["unit_id"].to_list()
+    spike_trains = [
+        spike_times.to_numpy().astype(np.float64, copy=False)
+        for spike_times in df["spike_times"]
+    ]
 
     # Create MIDI object
     pm = pretty_midi.PrettyMIDI(initial_tempo=120)
 
+    # Determine pitches for all units up front
+    if pitch_mode == "firing_rate":
+        spike_lists = pl.col("spike_times")
+        stats = df.select(
+            count=spike_lists.list.len(),
+            span=(spike_lists.list.last() - spike_lists.list.first()).fill_null(0.0),
+        )
+        spike_counts, spike_spans = stats["count"], stats["span"]
+    else:
+        spike_counts = spike_spans = None
+    pitches = get_pitches_for_units(
+        unit_ids, spike_counts, spike_spans, mode=pitch_mode
+    )
+
     # Process each unit
     print(f"\nPitch mode: {pitch_mode}")
     print("Processing units:")
-    for idx, row in enumerate(df.iter_rows(named=True)):
-        unit_id = row["unit_id"]
-        spike_times_str = row["spike_times"]
-
-        # Parse spike times
-        spike_times = parse_spike_times(spike_times_str)
-
-        # Scale time
-        spike_times_scaled = spike_times * time_scale
-
-        # Determine pitch for this unit
-        pitch = get_pitch_for_unit(idx, unit_id, spike_times, mode=pitch_mode)
-
-        # Create instrument for this unit
-        program = idx % 128
-        instrument = pretty_midi.Instrument(program=program, name=f"Unit_{unit_id}")
+    if single_instrument:
+        # Notes are built once all units are in
+        results = [
+            _unit_note_times(spike_times, time_scale, note_duration)
+            for spike_times in spike_trains
+        ]
+    else:
+        results = [
+            _build_instrument(
+                idx,
+                unit_id,
+                spike_times,
+                time_scale,
+                note_duration,
+                base_velocity,
+                pitch,
+            )
+            for idx, (unit_id, spike_times, pitch) in enumerate(
+                zip(unit_ids, spike_trains, pitches.tolist())
+            )
+        ]
+
+    # Accumulate summary totals while assembling, rather than rescanning notes
+    total_duration = 0.0
+    total_notes = 0
+    unit_notes = []
+    for idx, (unit_id, pitch, result) in enumerate(
+        zip(unit_ids, pitches.tolist(), results)
+    ):
+        if single_instrument:
+            note_starts, note_ends = result
+            unit_notes.append((note_starts, note_ends, np.full(len(note_ends), pitch)))
+            program = 0
+        else:
+            instrument, note_ends = result
+            pm.instruments.append(instrument)
+            program = instrument.program
 
         print(
-            f"  Unit {idx} (ID={unit_id}): {len(spike_times)} spikes, pitch={pitch} ({pretty_midi.note_number_to_name(pitch)}), program={program}"
+            f"  Unit {idx} (ID={unit_id}): {len(note_ends)} spikes, pitch={pitch} ({NOTE_NAMES[pitch]}), program={program}"
+        )
+        total_notes += len(note_ends)
+        if len(note_ends):
+            total_duration = max(total_duration, float(note_ends.max()))
+
+    if single_instrument and unit_notes:
+        # Concatenate every unit's notes and materialize them in one pass
+        note_starts, note_ends, note_pitches = (
+            np.concatenate(arrays) for arrays in zip(*unit_notes)
+        )
+        # Interleave the units in start order so pm.write's event sort is cheap
+        order = np.argsort(note_starts, kind="stable")
+        note_starts, note_ends, note_pitches = (
+            note_starts[order],
+            note_ends[order],
+            note_pitches[order],
+        )
+        instrument = pretty_midi.Instrument(program=0, name="spikes")
+        instrument.notes = _make_notes(
+            note_starts, note_ends, note_pitches, base_velocity
         )
-
-        # Add notes for each spike
-        for spike_time in spike_times_scaled:
-            note = pretty_midi.Note(
-                velocity=base_velocity,
-                pitch=pitch,
-                start=spike_time,
-                end=spike_time + note_duration,
-            )
-            instrument.notes.append(note)
-
         pm.instruments.append(instrument)
 
     # Save MIDI file
@@ -198,11 +360,8 @@ def create_midi_from_spikes(
     pm.write(output_midi)
 
     # Print summary
-    total_duration = max([note.end for inst in pm.instruments for note in inst.notes])
-    total_notes = sum([len(inst.notes) for inst in pm.instruments])
-
     print(f"\n✓ MIDI file created successfully!")
-    print(f"  Total units: {len(pm.instruments)}")
+    print(f"  Total units: {len(unit_ids)}")
     print(f"  Total notes: {total_notes}")
     print(f"  Duration: {total_duration:.2f} seconds")
     print(f"  Time scale: {time_scale}x")
@@ -225,6 +384,7 @@ if __name__ == "__main__":
         units_to_sonify=UNITS_TO_SONIFY,
         max_units=MAX_UNITS,
         pitch_mode=PITCH_MODE,
+        single_instrument=SINGLE_INSTRUMENT,
     )
 
     print("\n" + "=" * 60)